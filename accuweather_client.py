@@ -0,0 +1,138 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import UPSTREAM_DURATION, UPSTREAM_QUOTA_REMAINING, UPSTREAM_RESPONSES, UPSTREAM_RETRIES
+from upstream_scheduler import INTERACTIVE, QuotaExceededError
+
+BASE_URL = "https://dataservice.accuweather.com"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """AccuWeather временно считается недоступным, запрос не отправлялся."""
+
+
+class CircuitBreaker:
+    """Размыкается после серии подряд идущих сбоев и пропускает пробный запрос после паузы."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Полуоткрытое состояние: пропускается один пробный запрос, остальные до его
+                # результата (или до следующей паузы) сразу получают CircuitOpenError
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+def is_quota_exceeded(response):
+    """AccuWeather отвечает 503 и при исчерпанной квоте ключа; такой ответ повторять бесполезно."""
+    if response.status_code != 503:
+        return False
+    if response.headers.get("RateLimit-Remaining") == "0":
+        return True
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    message = body.get("Message") if isinstance(body, dict) else None
+    return isinstance(message, str) and "allowed number of requests" in message.lower()
+
+
+class AccuWeatherClient:
+    """Общий клиент AccuWeather: пул keep-alive соединений, повторы с backoff и circuit breaker.
+
+    Одновременно выполняется не больше pool_size запросов, от кого бы они ни
+    шли (пул маршрутов, фоновые обновления), поэтому соединения из пула не
+    выбрасываются.
+    """
+
+    def __init__(self, api_key, base_url=BASE_URL, connect_timeout=3.05, read_timeout=5,
+                 max_retries=2, backoff_base=0.3, backoff_max=4, pool_size=20,
+                 failure_threshold=5, reset_timeout=30, scheduler=None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.scheduler = scheduler
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+        self.session = requests.Session()
+        # Повторы выполняются вручную ниже, urllib3 отвечает только за пул соединений
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _backoff(self, attempt):
+        # Экспоненциальная задержка с полным джиттером
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def get(self, path, params=None, priority=INTERACTIVE):
+        """GET к AccuWeather. Ответ 4xx/5xx возвращается как есть, для raise_for_status() у вызывающего."""
+        endpoint = path.lstrip("/").split("/")[0]
+        if not self.breaker.allow_request():
+            UPSTREAM_RESPONSES.inc(endpoint=endpoint, status="circuit_open")
+            raise CircuitOpenError("Сервис AccuWeather временно недоступен, повторите попытку позже")
+
+        params = dict(params or {}, apikey=self.api_key)
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        attempt = 0
+        while True:
+            if self.scheduler is not None:
+                # Каждая попытка, включая повторы, расходует квоту ключа
+                try:
+                    self.scheduler.acquire(priority)
+                except QuotaExceededError:
+                    UPSTREAM_RESPONSES.inc(endpoint=endpoint, status="quota_deferred")
+                    raise
+            try:
+                with self._slots, UPSTREAM_DURATION.time(endpoint=endpoint):
+                    response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                UPSTREAM_RESPONSES.inc(endpoint=endpoint, status="connection_error")
+                if attempt >= self.max_retries:
+                    self.breaker.record_failure()
+                    raise
+            else:
+                UPSTREAM_RESPONSES.inc(endpoint=endpoint, status=response.status_code)
+                remaining = response.headers.get("RateLimit-Remaining")
+                if remaining is not None and remaining.isdigit():
+                    UPSTREAM_QUOTA_REMAINING.set(int(remaining))
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                    return response
+                if is_quota_exceeded(response):
+                    # Сервис доступен, просто квота исчерпана: без повторов и без учёта в circuit breaker
+                    return response
+                if attempt >= self.max_retries:
+                    self.breaker.record_failure()
+                    return response
+            UPSTREAM_RETRIES.inc(endpoint=endpoint)
+            time.sleep(self._backoff(attempt))
+            attempt += 1
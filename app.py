@@ -1,95 +1,247 @@
-from flask import Flask, render_template, request, session, jsonify, has_request_context
+from flask import (Blueprint, Flask, Response, render_template, request, session, jsonify,
+                   stream_template, g, before_render_template, template_rendered)
 import requests
 import os
+import json
+import contextvars
+import time
+import uuid
 from dotenv import load_dotenv
-from flask_caching import Cache
 import logging
-import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output
-import plotly.graph_objs as go
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from accuweather_client import AccuWeatherClient, BASE_URL
+from forecast_cache import create_forecast_cache
+from forecast_columns import ForecastColumns, classify_columns, condition_text, load_thresholds
+from geocode_index import create_geocode_index, normalize_city
+from route_grid import densify_route, geohash_center
+from route_store import create_route_store
+from metrics import (CACHE_LOOKUP_DURATION, CACHE_REQUESTS, FUNCTION_DURATION,
+                     HTTP_REQUEST_DURATION, SESSION_COOKIE_BYTES, TEMPLATE_RENDER_DURATION, registry,
+                     request_id_var, timed, trace)
+import metrics
+from upstream_scheduler import BACKGROUND, INTERACTIVE, HotLocationPrefetcher, QuotaScheduler
 
 load_dotenv()
 
-app = Flask(__name__)
-app.secret_key = os.urandom(24)
-
-cache = Cache(app, config={"CACHE_TYPE": "simple"})
+bp = Blueprint("weather", __name__)
+# Ключ подписи cookie должен совпадать во всех воркерах, иначе сессия (route_id) видна
+# только выдавшему её процессу; без SECRET_KEY ключ случайный для каждого запуска
+SECRET_KEY = os.getenv("SECRET_KEY") or os.urandom(24)
 
 API_KEY = os.getenv("ACCUWEATHER_API_KEY")
 # Убедитесь, что API_KEY корректно загружен
 if not API_KEY:
     raise ValueError("Не найден API-ключ AccuWeather. Проверьте файл .env.")
 
+# Максимальное число параллельных запросов к AccuWeather при обработке маршрутов - на процесс,
+# общее для всех одновременных запросов
+ROUTE_MAX_WORKERS = int(os.getenv("ROUTE_MAX_WORKERS", "16"))
+# Максимальное число маршрутов в одном запросе к /api/routes
+MAX_BATCH_ROUTES = int(os.getenv("MAX_BATCH_ROUTES", "1000"))
+# Максимальное число городов в одном маршруте пакета и различных городов во всём пакете
+MAX_ROUTE_CITIES = int(os.getenv("MAX_ROUTE_CITIES", "25"))
+MAX_BATCH_CITIES = int(os.getenv("MAX_BATCH_CITIES", "1000"))
+# Длины дневного прогноза, которые поддерживает AccuWeather (forecasts/v1/daily/{N}day)
+FORECAST_DAYS = (1, 5, 10, 15)
+# Точки погоды вдоль маршрута: шаг в км, точность геохеша (4 - ячейка ~40x20 км) и лимит точек
+ROUTE_SAMPLE_SPACING_KM = float(os.getenv("ROUTE_SAMPLE_SPACING_KM", "50"))
+ROUTE_SAMPLE_PRECISION = int(os.getenv("ROUTE_SAMPLE_PRECISION", "4"))
+ROUTE_MAX_SAMPLES = int(os.getenv("ROUTE_MAX_SAMPLES", "30"))
+# Потоковая выдача результатов маршрута на главной странице
+STREAM_ROUTE_RESULTS = os.getenv("STREAM_ROUTE_RESULTS", "1") == "1"
+
+# Один пул на процесс: параллельность ограничена для всех запросов вместе, а не для каждого отдельно
+route_executor = ThreadPoolExecutor(max_workers=ROUTE_MAX_WORKERS, thread_name_prefix="route")
+
+geocode_index = create_geocode_index()
+forecast_cache = create_forecast_cache()
+route_store = create_route_store()
+
+# Пороги "плохой погоды", настраиваются через BAD_WEATHER_* в .env
+WEATHER_THRESHOLDS = load_thresholds()
+
+# Суточная квота ключа AccuWeather; 0 - без ограничения. Корзина токенов хранится в файле
+# кэша прогнозов и общая для всех воркеров
+ACCUWEATHER_DAILY_QUOTA = int(os.getenv("ACCUWEATHER_DAILY_QUOTA", "0"))
+scheduler = QuotaScheduler(ACCUWEATHER_DAILY_QUOTA, forecast_cache.path) if ACCUWEATHER_DAILY_QUOTA else None
+
+upstream = AccuWeatherClient(
+    API_KEY,
+    base_url=os.getenv("ACCUWEATHER_BASE_URL", BASE_URL),
+    connect_timeout=float(os.getenv("ACCUWEATHER_CONNECT_TIMEOUT", "3.05")),
+    read_timeout=float(os.getenv("ACCUWEATHER_READ_TIMEOUT", "5")),
+    max_retries=int(os.getenv("ACCUWEATHER_MAX_RETRIES", "2")),
+    # По соединению на поток общего пула маршрутов; фоновые обновления ждут свободное
+    pool_size=ROUTE_MAX_WORKERS,
+    scheduler=scheduler
+)
+
+# Фоновое обновление самых популярных прогнозов незадолго до истечения кэша
+PREFETCH_LEAD_TIME = int(os.getenv("PREFETCH_LEAD_TIME", "600"))
+if os.getenv("PREFETCH_ENABLED", "1") == "1":
+    prefetcher = HotLocationPrefetcher(
+        expires_in=lambda location_key, days: forecast_cache.expires_in(forecast_cache_key(location_key, days)),
+        # Если другой воркер уже обновил прогноз, запись живёт дольше lead_time и запрос не нужен
+        refresh=lambda location_key, days: refresh_weather(location_key, days, min_ttl=PREFETCH_LEAD_TIME),
+        top_n=int(os.getenv("PREFETCH_TOP_N", "20")),
+        lead_time=PREFETCH_LEAD_TIME,
+        interval=int(os.getenv("PREFETCH_INTERVAL", "60"))
+    )
+else:
+    prefetcher = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@timed(FUNCTION_DURATION, function="get_location_key_by_city")
 def get_location_key_by_city(city):
-    params = {"apikey": API_KEY, "q": city}
+    with CACHE_LOOKUP_DURATION.time(cache="geocode"):
+        found, location = geocode_index.lookup(city)
+    CACHE_REQUESTS.inc(cache="geocode", result="hit" if found else "miss")
+    if found:
+        return location
+
+    params = {"q": city}
     try:
-        response = requests.get(
-            "https://dataservice.accuweather.com/locations/v1/cities/search",
-            params=params,
-            timeout=5
-        )
+        response = upstream.get("locations/v1/cities/search", params=params)
         response.raise_for_status()
         data = response.json()
         if data:
             location = data[0]
-            return {
+            location = {
                 "Key": location.get("Key"),
                 "LocalizedName": location.get("LocalizedName"),
                 "Latitude": location.get("GeoPosition", {}).get("Latitude"),
                 "Longitude": location.get("GeoPosition", {}).get("Longitude")
             }
         else:
-            return None
+            location = None
+        geocode_index.store(city, location)
+        return location
     except requests.exceptions.RequestException as req_err:
-        logger.error(f"Ошибка при запросе locationKey для города {city}: {req_err}")
+        logger.error("Ошибка при запросе locationKey для города %s: %s", city, req_err)
         return {"error": f"Ошибка при поиске города '{city}': {str(req_err)}"}
 
-def check_bad_weather(temperature, wind_speed, precipitation_probability):
-    conditions = []
-    if temperature < -15 or temperature > 35:
-        conditions.append("Температура слишком низкая или высокая")
-    if wind_speed > 50:
-        conditions.append("Сильный ветер")
-    if precipitation_probability > 60:
-        conditions.append("Высокая вероятность осадков")
-    
-    if conditions:
-        return "Плохие погодные условия: " + ", ".join(conditions)
-    return "Хорошие погодные условия"
-
-@cache.memoize(timeout=3600)
-def get_weather(location_key, days=5):
-    url = f"https://dataservice.accuweather.com/forecasts/v1/daily/{days}day/{location_key}"
-    params = {"apikey": API_KEY, "details": "true", "metric": "true"}
+@timed(FUNCTION_DURATION, function="get_location_key_by_geoposition")
+def get_location_key_by_geoposition(geohash):
+    # Ячейка геохеша сопоставляется одному locationKey, он хранится в том же индексе, что и города
+    query = f"geo:{geohash}"
+    with CACHE_LOOKUP_DURATION.time(cache="geocode"):
+        found, location = geocode_index.lookup(query)
+    CACHE_REQUESTS.inc(cache="geocode", result="hit" if found else "miss")
+    if found:
+        return location
+
+    latitude, longitude = geohash_center(geohash)
+    params = {"q": f"{latitude:.4f},{longitude:.4f}"}
     try:
-        response = requests.get(url, params=params, timeout=5)
+        response = upstream.get("locations/v1/cities/geoposition/search", params=params)
         response.raise_for_status()
         data = response.json()
-        forecasts = data.get("DailyForecasts", [])
-        
-        weather_data = []
-        for forecast in forecasts:
-            day_weather = {
-                "date": forecast.get("Date", "N/A")[:10],
-                "temperature_max": forecast.get("Temperature", {}).get("Maximum", {}).get("Value", "N/A"),
-                "temperature_min": forecast.get("Temperature", {}).get("Minimum", {}).get("Value", "N/A"),
-                "wind_speed": forecast.get("Day", {}).get("Wind", {}).get("Speed", {}).get("Value", "N/A"),
-                "precipitation_probability": forecast.get("Day", {}).get("PrecipitationProbability", "N/A"),
-                "weather_condition": check_bad_weather(
-                    forecast.get("Temperature", {}).get("Maximum", {}).get("Value", 0),
-                    forecast.get("Day", {}).get("Wind", {}).get("Speed", {}).get("Value", 0),
-                    forecast.get("Day", {}).get("PrecipitationProbability", 0)
-                ),
+        if data:
+            location = {
+                "Key": data.get("Key"),
+                "LocalizedName": data.get("LocalizedName"),
+                "Latitude": data.get("GeoPosition", {}).get("Latitude"),
+                "Longitude": data.get("GeoPosition", {}).get("Longitude")
             }
-            weather_data.append(day_weather)
-        
-        return weather_data
+        else:
+            location = None
+        geocode_index.store(query, location, aliases=False)
+        return location
+    except requests.exceptions.RequestException as req_err:
+        logger.error("Ошибка при запросе locationKey для ячейки %s: %s", geohash, req_err)
+        return {"error": f"Ошибка при поиске точки {latitude:.2f}, {longitude:.2f}: {str(req_err)}"}
+
+def resolve_sample(geohash, latitude, longitude, days):
+    location = get_location_key_by_geoposition(geohash)
+    if location is None or "error" in location:
+        return None
+    weather_data = get_weather(location["Key"], days=days)
+    if is_weather_error(weather_data):
+        return None
+    return {
+        "geohash": geohash,
+        "name": location["LocalizedName"],
+        "latitude": latitude,
+        "longitude": longitude,
+        "forecast": weather_data
+    }
+
+def get_route_samples(points, days=5):
+    """Погода в ячейках геохеша между городами маршрута; прогнозы кэшируются по ячейкам."""
+    cells = densify_route(
+        [(point["latitude"], point["longitude"]) for point in points],
+        spacing_km=ROUTE_SAMPLE_SPACING_KM,
+        precision=ROUTE_SAMPLE_PRECISION,
+        max_samples=ROUTE_MAX_SAMPLES
+    )
+    if not cells:
+        return []
+    futures = [submit_in_context(route_executor, resolve_sample, *cell, days) for cell in cells]
+    samples = [sample for sample in (future.result() for future in futures) if sample is not None]
+    # Прогнозы всех точек классифицируются одним вызовом, в точке остаётся только итог последнего дня
+    forecasts = classify_forecasts([sample.pop("forecast") for sample in samples])
+    for sample, forecast in zip(samples, forecasts):
+        sample["weather_condition"] = condition_text(forecast.conditions[-1])
+        sample["bad_weather"] = forecast.conditions[-1] != 0
+    return samples
+
+def save_route(points, days, route_id=None, sample_route=False):
+    samples = []
+    if sample_route:
+        try:
+            samples = get_route_samples(points, days)
+        except Exception as e:
+            logger.error("Ошибка при построении точек вдоль маршрута: %s", e)
+    return route_store.save(points, days, route_id=route_id, samples=samples)
+
+def forecast_cache_key(location_key, days):
+    # В кэше хранятся столбцы прогноза (ForecastColumns.to_dict), а не подневные словари
+    return f"columns:{location_key}:{days}"
+
+def is_weather_error(weather_data):
+    return not weather_data or "error" in weather_data or not weather_data.get("dates")
+
+def classify_forecasts(forecasts):
+    """Прогнозы из кэша -> классифицированные ForecastColumns, все одним вызовом classify_columns.
+
+    None и словари с ошибкой возвращаются как есть, на своих местах.
+    """
+    columns = {index: ForecastColumns.from_dict(forecast) for index, forecast in enumerate(forecasts)
+               if isinstance(forecast, dict) and "error" not in forecast}
+    classify_columns(list(columns.values()), WEATHER_THRESHOLDS)
+    return [columns.get(index, forecast) for index, forecast in enumerate(forecasts)]
+
+@timed(FUNCTION_DURATION, function="get_weather")
+def get_weather(location_key, days=5):
+    if prefetcher is not None:
+        prefetcher.record(location_key, days)
+    return forecast_cache.get_or_load(
+        forecast_cache_key(location_key, days),
+        lambda: fetch_weather(location_key, days),
+        is_error=is_weather_error
+    )
+
+def refresh_weather(location_key, days=5, min_ttl=None):
+    forecast_cache.refresh(
+        forecast_cache_key(location_key, days),
+        lambda: fetch_weather(location_key, days, priority=BACKGROUND),
+        is_error=is_weather_error,
+        min_ttl=min_ttl
+    )
+
+def fetch_weather(location_key, days=5, priority=INTERACTIVE):
+    path = f"forecasts/v1/daily/{days}day/{location_key}"
+    params = {"details": "true", "metric": "true"}
+    try:
+        response = upstream.get(path, params=params, priority=priority)
+        response.raise_for_status()
+        data = response.json()
+        return ForecastColumns.from_accuweather(data).to_dict()
     except requests.exceptions.HTTPError as http_err:
-        logger.error(f"HTTP error при запросе погоды для locationKey {location_key}: {http_err}")
+        logger.error("HTTP error при запросе погоды для locationKey %s: %s", location_key, http_err)
         try:
             error_detail = http_err.response.json()
             error_message = error_detail.get("Message", str(http_err))
@@ -97,10 +249,171 @@ def get_weather(location_key, days=5):
             error_message = http_err.response.text or str(http_err)
         return {"error": f"HTTP error: {http_err.response.status_code} {error_message}"}
     except requests.exceptions.RequestException as req_err:
-        logger.error(f"Ошибка при запросе погоды для locationKey {location_key}: {req_err}")
+        logger.error("Ошибка при запросе погоды для locationKey %s: %s", location_key, req_err)
         return {"error": f"Ошибка запроса: {str(req_err)}"}
 
-@app.route("/", methods=["GET", "POST"])
+def submit_in_context(executor, fn, *args):
+    # Потоки общего пула получают идентификатор запроса для трассировки
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+def build_route_point(city, location, weather_data):
+    if location is None:
+        return {
+            "error": f'Город "{city}" не найден. Проверьте правильность названия.'
+        }
+    if isinstance(location, dict) and "error" in location:
+        return {
+            "error": location["error"]
+        }
+    if isinstance(weather_data, dict) and "error" in weather_data:
+        return {
+            "error": f'Не удалось получить данные о погоде для города "{city}": {weather_data["error"]}'
+        }
+    if not weather_data:
+        return {
+            "error": f'Не удалось получить данные о погоде для города "{city}".'
+        }
+    # Подневные словари строятся только здесь - для шаблона, API и хранилища маршрутов
+    return {
+        "city": location["LocalizedName"],
+        "latitude": location["Latitude"],
+        "longitude": location["Longitude"],
+        "weather": weather_data.to_days()
+    }
+
+def resolve_city(city, days=5):
+    """(location, прогноз из кэша) для города; прогноз запрашивается сразу, как только получен locationKey."""
+    location = get_location_key_by_city(city)
+    weather_data = None
+    if isinstance(location, dict) and "error" not in location:
+        weather_data = get_weather(location["Key"], days=days)
+    return location, weather_data
+
+def resolve_route(cities, days=5):
+    # Все точки маршрута обрабатываются параллельно, результат - в порядке маршрута
+    if not cities:
+        return []
+    futures = [submit_in_context(route_executor, resolve_city, city, days) for city in cities]
+    results = [future.result() for future in futures]
+    forecasts = classify_forecasts([weather_data for _, weather_data in results])
+    return [build_route_point(city, location, forecast)
+            for city, (location, _), forecast in zip(cities, results, forecasts)]
+
+class RouteStream:
+    """Итератор (index, point) по мере готовности точек; успешные точки сохраняются в route_store."""
+
+    def __init__(self, cities, days, route_id, sample_route=False):
+        self.cities = cities
+        self.days = days
+        self.route_id = route_id
+        self.sample_route = sample_route
+        self.points = []
+
+    def __iter__(self):
+        results = {}
+        futures = {submit_in_context(route_executor, resolve_city, city, self.days): index
+                   for index, city in enumerate(self.cities)}
+        try:
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    # Точки отдаются по одной, поэтому и классифицируются по одной
+                    location, weather_data = future.result()
+                    point = build_route_point(self.cities[index], location, classify_forecasts([weather_data])[0])
+                except Exception as e:
+                    logger.error("Ошибка при обработке города %s: %s", self.cities[index], e)
+                    point = {"error": f'Произошла внутренняя ошибка при обработке города "{self.cities[index]}".'}
+                results[index] = point
+                yield index, point
+        finally:
+            # Клиент мог отключиться: ещё не начатые города этого маршрута из общего пула убираются
+            for future in futures:
+                future.cancel()
+        self.points = [results[index] for index in sorted(results) if "error" not in results[index]]
+        if self.points:
+            save_route(self.points, self.days, route_id=self.route_id, sample_route=self.sample_route)
+
+def resolve_routes_batch(routes):
+    """Разрешает много маршрутов сразу и отдаёт (index, result) по мере готовности маршрутов.
+
+    Каждый уникальный город геокодируется один раз, прогноз для каждой пары
+    (locationKey, days) запрашивается один раз на весь пакет.
+    """
+    # Единица работы - (нормализованный город, дни); маршрут готов, когда готовы все его точки
+    waiters = {}
+    remaining = []
+    city_queries = {}
+    days_by_city = {}
+    for index, (cities, days) in enumerate(routes):
+        remaining.append(len(cities))
+        for city in cities:
+            normalized = normalize_city(city)
+            city_queries.setdefault(normalized, city)
+            days_by_city.setdefault(normalized, set()).add(days)
+            waiters.setdefault((normalized, days), []).append(index)
+
+    locations = {}
+    forecasts = {}
+    forecast_units = {}
+    pending = {submit_in_context(route_executor, get_location_key_by_city, query): ("city", normalized)
+               for normalized, query in city_queries.items()}
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            completed_units = []
+            loaded = []
+            for future in done:
+                kind, key = pending.pop(future)
+                if kind == "city":
+                    location = future.result()
+                    locations[key] = location
+                    for days in days_by_city[key]:
+                        if location is None or "error" in location:
+                            completed_units.append((key, days))
+                            continue
+                        forecast_key = (location["Key"], days)
+                        if forecast_key in forecasts:
+                            # Прогноз уже получен для другого названия того же города
+                            completed_units.append((key, days))
+                            continue
+                        if forecast_key not in forecast_units:
+                            forecast_units[forecast_key] = []
+                            forecast_future = submit_in_context(route_executor, get_weather, location["Key"], days)
+                            pending[forecast_future] = ("forecast", forecast_key)
+                        forecast_units[forecast_key].append((key, days))
+                else:
+                    loaded.append((key, future.result()))
+
+            # Прогнозы, пришедшие за этот шаг, классифицируются одним вызовом
+            for (key, _), forecast in zip(loaded, classify_forecasts([data for _, data in loaded])):
+                forecasts[key] = forecast
+                completed_units.extend(forecast_units[key])
+
+            for unit in completed_units:
+                for index in waiters[unit]:
+                    remaining[index] -= 1
+                    if remaining[index] == 0:
+                        yield index, build_batch_route(routes[index], locations, forecasts)
+    finally:
+        # Клиент мог отключиться: ещё не начатые задачи пакета из общего пула убираются
+        for future in pending:
+            future.cancel()
+
+def build_batch_route(route, locations, forecasts):
+    cities, days = route
+    points = []
+    for city in cities:
+        location = locations[normalize_city(city)]
+        weather_data = None
+        if location is not None and "error" not in location:
+            weather_data = forecasts[(location["Key"], days)]
+        point = build_route_point(city, location, weather_data)
+        if "error" in point:
+            return point
+        points.append(point)
+    return {"weather": points, "days": days}
+
+@bp.route("/", methods=["GET", "POST"])
 def index():
     weather = []
     if request.method == "POST":
@@ -109,237 +422,193 @@ def index():
         intermediate_cities = request.form.getlist("intermediate_cities[]")
         days = request.form.get("days", 5)
         days = int(days) if days.isdigit() else 5
+        sample_route = request.form.get("sample_route") == "on"
 
         all_cities = [start_city] + intermediate_cities + [end_city]
 
+        if all_cities and start_city and end_city and STREAM_ROUTE_RESULTS:
+            # Карточки городов отправляются по мере готовности, ошибка одного города не прерывает маршрут
+            route_id = route_store.new_route_id()
+            session['route_id'] = route_id
+            weather_stream = RouteStream(all_cities, days, route_id, sample_route=sample_route)
+            # stream_template сам оборачивает генератор в stream_with_context
+            return Response(stream_template("index.html", weather=[], weather_stream=weather_stream))
+
         if all_cities and start_city and end_city:
             try:
                 weather_points = []
-                for city in all_cities:
-                    location = get_location_key_by_city(city)
-                    if location is None:
-                        weather = {
-                            "error": f'Город "{city}" не найден. Проверьте правильность названия.'
-                        }
-                        return render_template("index.html", weather=weather)
-                    if isinstance(location, dict) and "error" in location:
-                        weather = {
-                            "error": location["error"]
-                        }
-                        return render_template("index.html", weather=weather)
-                    
-                    weather_data = get_weather(location["Key"], days=days)
-                    if isinstance(weather_data, dict) and "error" in weather_data:
-                        weather = {
-                            "error": f'Не удалось получить данные о погоде для города "{city}": {weather_data["error"]}'
-                        }
+                for point in resolve_route(all_cities, days):
+                    if "error" in point:
+                        weather = point
                         return render_template("index.html", weather=weather)
-                    if not weather_data:
-                        weather = {
-                            "error": f'Не удалось получить данные о погоде для города "{city}".'
-                        }
-                        return render_template("index.html", weather=weather)
-                    
-                    weather_points.append({
-                        "city": location["LocalizedName"],
-                        "latitude": location["Latitude"],
-                        "longitude": location["Longitude"],
-                        "weather": weather_data
-                    })
-                
-                session['weather'] = weather_points
-                session['days'] = days
+                    weather_points.append(point)
+
+                session['route_id'] = save_route(weather_points, days, sample_route=sample_route)
 
                 weather = weather_points
 
             except Exception as e:
-                logger.error(f"Ошибка при обработке запроса: {e}")
+                logger.error("Ошибка при обработке запроса: %s", e)
                 weather = {
                     "error": "Произошла внутренняя ошибка. Пожалуйста, попробуйте позже."
                 }
     return render_template("index.html", weather=weather)
 
-@app.route("/api/weather")
+@bp.route("/api/weather")
 def get_weather_api():
-    weather = session.get('weather')
-    days = session.get('days', 5)
-    if not weather:
+    route_id = session.get('route_id')
+    summary = route_store.get_summary(route_id)
+    points_json = route_store.get_points_json(route_id)
+    if not summary or points_json is None:
         return jsonify({"error": "No weather data available."}), 400
-    return jsonify({"weather": weather, "days": days}), 200
+    body = b'{"weather":' + points_json + b',"days":' + str(summary["days"]).encode() + b'}'
+    return Response(body, status=200, mimetype="application/json")
 
-dash_app = dash.Dash(
-    __name__,
-    server=app,
-    url_base_pathname='/dash/',
-    external_stylesheets=['https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css']
-)
+@bp.route("/api/routes", methods=["POST"])
+def get_routes_api():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get("routes"), list):
+        return jsonify({"error": "Expected a JSON object with a \"routes\" list."}), 400
+    if len(payload["routes"]) > MAX_BATCH_ROUTES:
+        return jsonify({"error": f"Too many routes, the limit is {MAX_BATCH_ROUTES}."}), 400
 
-def create_dash_layout():
-    if has_request_context():
-        weather = session.get('weather')
-        days = session.get('days', 5)
-        if weather:
-            options = [{'label': point['city'], 'value': point['city']} for point in weather]
+    default_days = payload.get("days", 5)
+    routes = []
+    for index, route in enumerate(payload["routes"]):
+        # Маршрут - список городов или объект {"cities": [...], "days": N}
+        if isinstance(route, dict):
+            cities, days = route.get("cities"), route.get("days", default_days)
         else:
-            options = []
-    else:
-        weather = None
-        days = 5
-        options = []
-    
-    return html.Div([
-        html.H1("Визуализация прогноза погоды", style={'textAlign': 'center', 'color': '#4169E1'}),
-        dcc.Dropdown(
-            id='city-dropdown',
-            options=options,
-            value=options[0]['value'] if options else None,
-            style={'width': '50%', 'margin': 'auto', 'marginBottom': '20px'}
-        ),
-        dcc.Graph(id='temperature-graph'),
-        dcc.Graph(id='precipitation-graph'),
-        dcc.Graph(id='map-graph'),
-        html.Div([
-            dcc.Checklist(
-                id='weather-parameters',
-                options=[
-                    {'label': 'Максимальная температура', 'value': 'temperature_max'},
-                    {'label': 'Минимальная температура', 'value': 'temperature_min'},
-                    {'label': 'Скорость ветра', 'value': 'wind_speed'},
-                    {'label': 'Вероятность осадков', 'value': 'precipitation_probability'}
-                ],
-                value=['temperature_max', 'temperature_min', 'wind_speed', 'precipitation_probability'],
-                labelStyle={'display': 'inline-block', 'margin-right': '10px'}
-            )
-        ], style={'textAlign': 'center', 'marginTop': '20px'})
-    ], className='container')
-
-dash_app.layout = create_dash_layout
-
-@dash_app.callback(
-    [Output('temperature-graph', 'figure'),
-     Output('precipitation-graph', 'figure'),
-     Output('map-graph', 'figure'),
-     Output('city-dropdown', 'options')],
-    [Input('city-dropdown', 'value'),
-     Input('weather-parameters', 'value')]
-)
-def update_graphs(selected_city, selected_parameters):
-    if not selected_city:
-        return go.Figure(), go.Figure(), go.Figure(), []
-    
-    try:
-        from flask import request
-        base_url = request.host_url.rstrip('/')
-        api_url = f"{base_url}/api/weather"
-        response = requests.get(api_url)
-        if response.status_code != 200:
-            logger.error(f"Ошибка при получении данных из API: {response.status_code} {response.text}")
-            return go.Figure(), go.Figure(), go.Figure(), []
-        data = response.json()
-        weather = data.get('weather')
-        days = data.get('days', 5)
-    except Exception as e:
-        logger.error(f"Ошибка при запросе API: {e}")
-        return go.Figure(), go.Figure(), go.Figure(), []
-    
-    options = [{'label': point['city'], 'value': point['city']} for point in weather]
-    
-    if selected_city not in [point['city'] for point in weather]:
-        return go.Figure(), go.Figure(), go.Figure(), options
-    
-    city_data = next((point for point in weather if point['city'] == selected_city), {})
-    city_weather = city_data.get('weather', [])
-    latitude = city_data.get('latitude')
-    longitude = city_data.get('longitude')
-    
-    dates = [day['date'] for day in city_weather]
-    temps_max = [day['temperature_max'] for day in city_weather]
-    temps_min = [day['temperature_min'] for day in city_weather]
-    precipitation = [day['precipitation_probability'] for day in city_weather]
-    wind_speed = [day['wind_speed'] for day in city_weather]
-    
-    temperature_traces = []
-    if 'temperature_max' in selected_parameters:
-        temperature_traces.append(go.Scatter(
-            x=dates,
-            y=temps_max,
-            mode='lines+markers',
-            name='Максимальная температура',
-            line=dict(color='#FF5733'),
-            hoverinfo='x+y'
-        ))
-    if 'temperature_min' in selected_parameters:
-        temperature_traces.append(go.Scatter(
-            x=dates,
-            y=temps_min,
-            mode='lines+markers',
-            name='Минимальная температура',
-            line=dict(color='#33C1FF'),
-            hoverinfo='x+y'
-        ))
-    
-    temp_fig = go.Figure(data=temperature_traces)
-    temp_fig.update_layout(
-        title=f'Прогноз температуры для {selected_city}',
-        xaxis_title='Дата',
-        yaxis_title='Температура (°C)',
-        template='plotly_white',
-        hovermode='closest'
-    )
-    
-    precip_trace = go.Bar(
-        x=dates,
-        y=precipitation,
-        name='Вероятность осадков',
-        marker_color='#42f44b',
-        hoverinfo='x+y'
-    )
-    precip_fig = go.Figure(data=[precip_trace])
-    precip_fig.update_layout(
-        title=f'Вероятность осадков для {selected_city}',
-        xaxis_title='Дата',
-        yaxis_title='Вероятность осадков (%)',
-        template='plotly_white',
-        hovermode='closest'
-    )
-    
-    # Создание маршрута на карте
-    latitudes = [point['latitude'] for point in weather]
-    longitudes = [point['longitude'] for point in weather]
-    city_names = [point['city'] for point in weather]
-    weather_conditions = [point['weather'][-1]['weather_condition'] for point in weather]
-    
-    # Добавление линии маршрута
-    route_trace = go.Scattermapbox(
-        lat=latitudes,
-        lon=longitudes,
-        mode='markers+lines',
-        marker=go.scattermapbox.Marker(
-            size=10,
-            color='#FF5733'
-        ),
-        line=go.scattermapbox.Line(
-            width=2,
-            color='#1f78b4'
-        ),
-        text=[f"{city}: {condition}" for city, condition in zip(city_names, weather_conditions)],
-        hoverinfo='text',
-        name='Маршрут'
-    )
-    
-    # Создание фигуры карты
-    map_fig = go.Figure(data=[route_trace])
-    map_fig.update_layout(
-        mapbox=dict(
-            style="open-street-map",
-            center=dict(lat=latitude, lon=longitude),
-            zoom=5
-        ),
-        margin={"r":0,"t":0,"l":0,"b":0},
-        hovermode='closest'
-    )
-    
-    return temp_fig, precip_fig, map_fig, options
+            cities, days = route, default_days
+        if (not isinstance(cities, list) or not cities
+                or not all(isinstance(city, str) and city.strip() for city in cities)):
+            return jsonify({"error": f"Route {index}: expected a non-empty list of city names."}), 400
+        if len(cities) > MAX_ROUTE_CITIES:
+            return jsonify({"error": f"Route {index}: too many cities, the limit is {MAX_ROUTE_CITIES}."}), 400
+        # bool - подкласс int, поэтому true/false отсекаются отдельно
+        if not isinstance(days, int) or isinstance(days, bool) or days not in FORECAST_DAYS:
+            allowed = ", ".join(map(str, FORECAST_DAYS))
+            return jsonify({"error": f"Route {index}: \"days\" must be one of {allowed}."}), 400
+        routes.append((cities, days))
+    if len({normalize_city(city) for cities, _ in routes for city in cities}) > MAX_BATCH_CITIES:
+        return jsonify({"error": f"Too many different cities, the limit is {MAX_BATCH_CITIES}."}), 400
+
+    def generate():
+        try:
+            for index, result in resolve_routes_batch(routes):
+                yield json.dumps(dict(result, index=index), ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error("Ошибка при пакетной обработке маршрутов: %s", e)
+            yield json.dumps({"error": "Произошла внутренняя ошибка. Пожалуйста, попробуйте позже."},
+                             ensure_ascii=False) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+# Включает запись в лог span'ов каждого запроса с его идентификатором
+metrics.trace_enabled = os.getenv("TRACE_REQUESTS", "0") == "1"
+
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    request_id_var.set(request.headers.get("X-Request-ID") or uuid.uuid4().hex[:12])
+    SESSION_COOKIE_BYTES.observe(len(request.headers.get("Cookie", "")))
+
+def observe_request(started, endpoint, method, status):
+    seconds = time.perf_counter() - started
+    HTTP_REQUEST_DURATION.observe(seconds, endpoint=endpoint, method=method, status=status)
+    trace("http_request", seconds, endpoint=endpoint, status=status)
+
+def record_request_metrics(response):
+    if "request_started" in g:
+        args = (g.request_started, request.endpoint or "unknown", request.method, response.status_code)
+        if response.is_streamed:
+            # after_request срабатывает до генерации потокового тела: время считается до закрытия ответа
+            context = contextvars.copy_context()
+            response.call_on_close(lambda: context.run(observe_request, *args))
+        else:
+            observe_request(*args)
+    response.headers["X-Request-ID"] = request_id_var.get()
+    return response
+
+def start_template_timer(sender, template, context, **extra):
+    g.setdefault("template_started", {})[template.name] = time.perf_counter()
+
+def record_template_render(sender, template, context, **extra):
+    started = g.get("template_started", {}).pop(template.name, None)
+    if started is not None:
+        seconds = time.perf_counter() - started
+        TEMPLATE_RENDER_DURATION.observe(seconds, template=template.name)
+        trace("render_template", seconds, template=template.name)
+
+def init_instrumentation(flask_app):
+    flask_app.before_request(start_request_timer)
+    flask_app.after_request(record_request_metrics)
+    before_render_template.connect(start_template_timer, flask_app)
+    template_rendered.connect(record_template_render, flask_app)
+
+@bp.route("/metrics")
+def get_metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+@bp.route("/api/cities")
+def get_cities_api():
+    prefix = request.args.get("q", "")
+    return jsonify({"cities": geocode_index.search_prefix(prefix)}), 200
+
+# Режим дашборда: "lazy" - Dash и Plotly загружаются при первом запросе к /dash/,
+# "eager" - при запуске приложения, "off" - дашборд отключён
+DASH_MODE = os.getenv("DASH_MODE", "lazy")
+
+class LazyDashMiddleware:
+    """WSGI-обёртка, которая передаёт /dash/ отдельному Flask-серверу Dash, создавая его при первом обращении."""
+
+    def __init__(self, wsgi_app, create_dash_server, eager=False):
+        self.wsgi_app = wsgi_app
+        self.create_dash_server = create_dash_server
+        self._dash_server = None
+        self._lock = threading.Lock()
+        if eager:
+            self._get_dash_server()
+
+    def _get_dash_server(self):
+        if self._dash_server is None:
+            with self._lock:
+                if self._dash_server is None:
+                    self._dash_server = self.create_dash_server()
+        return self._dash_server
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path == "/dash" or path.startswith("/dash/"):
+            return self._get_dash_server()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+def create_dash_server(app):
+    from dashboard import create_dash_app
+
+    # Отдельный сервер с тем же ключом и сессией, что и у приложения: колбэки читают route_id из cookie
+    server = Flask(__name__)
+    server.secret_key = app.secret_key
+    server.session_interface = app.session_interface
+    init_instrumentation(server)
+    create_dash_app(server, route_store)
+    return server
+
+def create_app():
+    app = Flask(__name__)
+    app.secret_key = SECRET_KEY
+    app.register_blueprint(bp)
+    init_instrumentation(app)
+    # Шаблон компилируется при запуске, а не на первом запросе
+    app.jinja_env.get_template("index.html")
+    if DASH_MODE != "off":
+        app.wsgi_app = LazyDashMiddleware(
+            app.wsgi_app,
+            lambda: create_dash_server(app),
+            eager=DASH_MODE == "eager"
+        )
+    return app
+
+app = create_app()
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,215 @@
+"""Нагрузочный бенчмарк приложения на локальной замене AccuWeather.
+
+Поднимает mock_accuweather и app.py в потоках этого процесса (кэши - во
+временном каталоге, так что каждый запуск начинается с холодного кэша) и
+прогоняет сценарии с заданной параллельностью:
+
+- POST / с маршрутами разной длины;
+- GET /api/weather;
+- обновление графиков Dash (/dash/_dash-update-component).
+
+Для каждого сценария выводятся пропускная способность, p50/p95/p99 задержки
+и среднее число запросов к AccuWeather на один запрос.
+
+Пример: python benchmarks/bench_app.py --requests 200 --concurrency 16 --latency 0.1
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_accuweather import create_mock_app  # noqa: E402
+
+
+def serve(wsgi_app):
+    server = make_server("127.0.0.1", 0, wsgi_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def make_route(rng, city_pool, length):
+    return rng.sample(city_pool, length)
+
+
+def post_route(client, base_url, cities, days=5):
+    form = {
+        "start_city": cities[0],
+        "end_city": cities[-1],
+        "intermediate_cities[]": cities[1:-1],
+        "days": str(days)
+    }
+    response = client.post(f"{base_url}/", data=form)
+    response.raise_for_status()
+    return response
+
+
+def dash_payload(base_url, client):
+    dependencies = client.get(f"{base_url}/dash/_dash-dependencies").json()
+    callback = next(dep for dep in dependencies if dep["output"].startswith(".."))
+    outputs = [
+        {"id": "temperature-graph", "property": "figure"},
+        {"id": "precipitation-graph", "property": "figure"},
+        {"id": "map-graph", "property": "figure"},
+        {"id": "city-dropdown", "property": "options"}
+    ]
+    return callback["output"], outputs
+
+
+def route_succeeded(response):
+    # Ошибки городов приходят внутри страницы с кодом 200 (в потоковом режиме - карточками)
+    return "alert-danger" not in response.text
+
+
+def run_scenario(name, concurrency, total, prepare, request_once, mock_url):
+    """prepare(client) готовит каждого клиента до замера, request_once(client, state, i) - один запрос.
+
+    Запрос считается ошибкой, если он бросил RequestException или request_once вернул False.
+    """
+    clients = queue.Queue()
+    for _ in range(concurrency):
+        client = requests.Session()
+        clients.put((client, prepare(client)))
+
+    def worker(i):
+        client, state = clients.get()
+        started = time.perf_counter()
+        try:
+            ok = request_once(client, state, i) is not False
+        except requests.RequestException:
+            ok = False
+        finally:
+            clients.put((client, state))
+        return time.perf_counter() - started, ok
+
+    requests.post(f"{mock_url}/_reset")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(worker, range(total)))
+    elapsed = time.perf_counter() - started
+    upstream_calls = requests.get(f"{mock_url}/_stats").json().get("calls", 0)
+
+    latencies = [latency for latency, _ in results]
+    return {
+        "scenario": name,
+        "requests": total,
+        "errors": sum(1 for _, ok in results if not ok),
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "upstream_calls_per_request": round(upstream_calls / total, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app.py against a mock AccuWeather")
+    parser.add_argument("--requests", type=int, default=100, help="запросов в каждом сценарии")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--route-lengths", default="2,5,10", help="длины маршрутов для POST /")
+    parser.add_argument("--city-pool", type=int, default=100, help="число различных городов")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка mock AccuWeather, с")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--quota", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="сохранить результаты в файл JSON")
+    args = parser.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    mock = create_mock_app(args.latency, args.jitter, args.error_rate, args.quota, args.seed)
+    mock_server, mock_url = serve(mock)
+
+    workdir = tempfile.mkdtemp(prefix="weather-bench-")
+    os.environ.update({
+        "ACCUWEATHER_API_KEY": "benchmark",
+        "ACCUWEATHER_BASE_URL": mock_url,
+        "GEOCODE_INDEX_PATH": os.path.join(workdir, "geocode_index.sqlite3"),
+        "FORECAST_CACHE_PATH": os.path.join(workdir, "forecast_cache.sqlite3"),
+        "ROUTE_STORE_PATH": os.path.join(workdir, "route_store.sqlite3"),
+        "PREFETCH_ENABLED": "0"
+    })
+    import app as weather_app
+    app_server, app_url = serve(weather_app.app)
+
+    rng = random.Random(args.seed)
+    city_pool = [f"City {i}" for i in range(args.city_pool)]
+    results = []
+
+    for length in [int(value) for value in args.route_lengths.split(",")]:
+        routes = [make_route(rng, city_pool, min(length, len(city_pool))) for _ in range(args.requests)]
+        results.append(run_scenario(
+            f"POST / ({length} cities)", args.concurrency, args.requests,
+            lambda client: None,
+            lambda client, state, i, routes=routes: route_succeeded(post_route(client, app_url, routes[i])),
+            mock_url
+        ))
+
+    def prepare_session(client):
+        post_route(client, app_url, make_route(random.Random(id(client)), city_pool, 3))
+        return client.get(f"{app_url}/api/weather").json()
+
+    results.append(run_scenario(
+        "GET /api/weather", args.concurrency, args.requests,
+        prepare_session,
+        lambda client, state, i: client.get(f"{app_url}/api/weather").raise_for_status(),
+        mock_url
+    ))
+
+    def prepare_dash(client):
+        route = prepare_session(client)
+        output, outputs = dash_payload(app_url, client)
+        return output, outputs, [point["city"] for point in route["weather"]]
+
+    def update_dash(client, state, i):
+        output, outputs, cities = state
+        parameters = ["temperature_max", "temperature_min", "wind_speed", "precipitation_probability"]
+        client.post(f"{app_url}/dash/_dash-update-component", json={
+            "output": output,
+            "outputs": outputs,
+            "inputs": [{"id": "city-dropdown", "property": "value", "value": cities[i % len(cities)]}],
+            "state": [{"id": "weather-parameters", "property": "value", "value": parameters}],
+            "changedPropIds": ["city-dropdown.value"]
+        }).raise_for_status()
+
+    results.append(run_scenario(
+        "Dash update_graphs", args.concurrency, args.requests,
+        prepare_dash, update_dash, mock_url
+    ))
+
+    app_server.shutdown()
+    mock_server.shutdown()
+
+    header = f"{'scenario':<24}{'req':>6}{'err':>5}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'upstream/req':>14}"
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        print(f"{row['scenario']:<24}{row['requests']:>6}{row['errors']:>5}{row['throughput_rps']:>9}"
+              f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}{row['upstream_calls_per_request']:>14}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
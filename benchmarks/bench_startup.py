@@ -0,0 +1,87 @@
+"""Бенчмарк запуска воркера: время импорта app.py и занимаемая память.
+
+Каждый замер выполняется в отдельном процессе Python для DASH_MODE=lazy и
+DASH_MODE=eager: время импорта app, пиковый RSS после импорта, время первого
+запроса к / и к /dash/ (в режиме lazy он включает загрузку Dash и Plotly).
+Выводятся медианы по нескольким запускам. Ключ AccuWeather не нужен.
+
+Пример: python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, resource, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+rss_import = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+client = app.app.test_client()
+started_index = time.perf_counter()
+client.get("/")
+index_done = time.perf_counter()
+client.get("/dash/")
+dash_done = time.perf_counter()
+rss_dash = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_index_ms": (index_done - started_index) * 1000,
+    "first_dash_ms": (dash_done - index_done) * 1000,
+    "rss_after_import_mb": rss_import / 1024,
+    "rss_after_dash_mb": rss_dash / 1024,
+}))
+"""
+
+
+def measure(mode, workdir):
+    env = dict(os.environ)
+    env.update({
+        "ACCUWEATHER_API_KEY": env.get("ACCUWEATHER_API_KEY", "benchmark"),
+        "GEOCODE_INDEX_PATH": os.path.join(workdir, "geocode_index.sqlite3"),
+        "FORECAST_CACHE_PATH": os.path.join(workdir, "forecast_cache.sqlite3"),
+        "ROUTE_STORE_PATH": os.path.join(workdir, "route_store.sqlite3"),
+        "PREFETCH_ENABLED": "0",
+        "DASH_MODE": mode
+    })
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=ROOT, env=env,
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app.py startup time and memory")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", help="сохранить результаты в файл JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="weather-startup-")
+    results = {}
+    for mode in ("lazy", "eager"):
+        runs = [measure(mode, workdir) for _ in range(args.runs)]
+        results[mode] = {
+            key: round(statistics.median(run[key] for run in runs), 1)
+            for key in ("import_ms", "first_index_ms", "first_dash_ms", "rss_after_import_mb", "rss_after_dash_mb")
+        }
+
+    header = f"{'DASH_MODE':<10}{'import ms':>11}{'first / ms':>12}{'first /dash/ ms':>17}{'RSS MB':>9}{'RSS+dash MB':>13}"
+    print(header)
+    print("-" * len(header))
+    for mode, row in results.items():
+        print(f"{mode:<10}{row['import_ms']:>11}{row['first_index_ms']:>12}{row['first_dash_ms']:>17}"
+              f"{row['rss_after_import_mb']:>9}{row['rss_after_dash_mb']:>13}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
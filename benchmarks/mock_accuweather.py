@@ -0,0 +1,143 @@
+"""Локальная замена API AccuWeather для нагрузочных тестов.
+
+Отдаёт детерминированные ответы locations/v1/cities/search,
+locations/v1/cities/geoposition/search и forecasts/v1/daily/{n}day с
+настраиваемой задержкой, долей ошибок 5xx и суточной квотой. Города, название которых начинается с "zz", "не найдены".
+
+Запуск: python benchmarks/mock_accuweather.py --port 8001 --latency 0.1
+и ACCUWEATHER_BASE_URL=http://127.0.0.1:8001 в .env приложения.
+"""
+import argparse
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import date, timedelta
+
+from flask import Flask, jsonify, request
+
+
+def create_mock_app(latency=0.05, jitter=0.0, error_rate=0.0, daily_quota=0, seed=None):
+    app = Flask(__name__)
+    stats = Counter()
+    lock = threading.Lock()
+    rng = random.Random(seed)
+
+    def location_key(query):
+        return str(zlib.crc32(query.strip().casefold().encode("utf-8")) % 10 ** 6)
+
+    @app.before_request
+    def simulate_upstream():
+        if request.path.startswith("/_"):
+            return None
+        with lock:
+            stats["calls"] += 1
+            stats[request.path.split("/")[1]] += 1
+            calls = stats["calls"]
+            fail = rng.random() < error_rate
+            delay = latency + rng.uniform(0, jitter)
+        time.sleep(delay)
+        if daily_quota and calls > daily_quota:
+            with lock:
+                stats["quota_exceeded"] += 1
+            response = jsonify({
+                "Code": "ServiceUnavailable",
+                "Message": "The allowed number of requests has been exceeded.",
+                "Reference": request.path
+            })
+            response.status_code = 503
+            return response
+        if fail:
+            with lock:
+                stats["errors"] += 1
+            return jsonify({"Code": "ServerError", "Message": "Mock upstream failure."}), 500
+        return None
+
+    @app.after_request
+    def add_rate_limit_headers(response):
+        if daily_quota and not request.path.startswith("/_"):
+            response.headers["RateLimit-Limit"] = str(daily_quota)
+            response.headers["RateLimit-Remaining"] = str(max(0, daily_quota - stats["calls"]))
+        return response
+
+    @app.route("/locations/v1/cities/search")
+    def cities_search():
+        query = request.args.get("q", "")
+        if not query.strip() or query.strip().casefold().startswith("zz"):
+            return jsonify([])
+        key = location_key(query)
+        place = random.Random(key)
+        return jsonify([{
+            "Key": key,
+            "LocalizedName": query.strip().title(),
+            "GeoPosition": {
+                "Latitude": round(place.uniform(41.0, 70.0), 3),
+                "Longitude": round(place.uniform(20.0, 140.0), 3)
+            }
+        }])
+
+    @app.route("/locations/v1/cities/geoposition/search")
+    def geoposition_search():
+        try:
+            latitude, longitude = (float(value) for value in request.args.get("q", "").split(","))
+        except ValueError:
+            return jsonify({"Code": "BadRequest", "Message": "Invalid geoposition."}), 400
+        # Ближайший "город" - узел сетки 0.5 градуса
+        latitude, longitude = round(latitude * 2) / 2, round(longitude * 2) / 2
+        return jsonify({
+            "Key": location_key(f"{latitude},{longitude}"),
+            "LocalizedName": f"Point {latitude:.1f},{longitude:.1f}",
+            "GeoPosition": {"Latitude": latitude, "Longitude": longitude}
+        })
+
+    @app.route("/forecasts/v1/daily/<int:days>day/<key>")
+    def daily_forecast(days, key):
+        weather = random.Random(f"{key}:{days}")
+        start = date.today()
+        forecasts = []
+        for offset in range(days):
+            minimum = round(weather.uniform(-30, 25), 1)
+            forecasts.append({
+                "Date": f"{(start + timedelta(days=offset)).isoformat()}T07:00:00+03:00",
+                "Temperature": {
+                    "Minimum": {"Value": minimum, "Unit": "C"},
+                    "Maximum": {"Value": round(minimum + weather.uniform(2, 15), 1), "Unit": "C"}
+                },
+                "Day": {
+                    "Wind": {"Speed": {"Value": round(weather.uniform(0, 70), 1), "Unit": "km/h"}},
+                    "PrecipitationProbability": weather.randint(0, 100)
+                }
+            })
+        return jsonify({"DailyForecasts": forecasts})
+
+    @app.route("/_stats")
+    def get_stats():
+        with lock:
+            return jsonify(dict(stats))
+
+    @app.route("/_reset", methods=["POST"])
+    def reset_stats():
+        with lock:
+            stats.clear()
+        return jsonify({})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock AccuWeather API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--quota", type=int, default=0, help="число запросов до ответов 503 (0 - без лимита)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    app = create_mock_app(args.latency, args.jitter, args.error_rate, args.quota, args.seed)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Дашборд Dash на /dash/.
+
+Модуль импортируется только при первом обращении к /dash/ (см. create_app в
+app.py), поэтому dash и plotly не загружаются воркерами, которые обслуживают
+лишь главную страницу и API.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+import dash
+from dash import Patch, dcc, html
+from dash.dependencies import Input, Output, State
+from flask import has_request_context, session
+import plotly.graph_objs as go
+
+from metrics import DASH_CALLBACK_DURATION, timed
+
+logger = logging.getLogger(__name__)
+
+# Хранилище маршрутов приложения, передаётся в create_dash_app
+route_store = None
+
+def create_dash_layout():
+    if has_request_context():
+        summary = route_store.get_summary(session.get('route_id'))
+        if summary:
+            options = [{'label': point['city'], 'value': point['city']} for point in summary['points']]
+        else:
+            options = []
+    else:
+        options = []
+    
+    return html.Div([
+        html.H1("Визуализация прогноза погоды", style={'textAlign': 'center', 'color': '#4169E1'}),
+        dcc.Dropdown(
+            id='city-dropdown',
+            options=options,
+            value=options[0]['value'] if options else None,
+            style={'width': '50%', 'margin': 'auto', 'marginBottom': '20px'}
+        ),
+        dcc.Graph(id='temperature-graph'),
+        dcc.Graph(id='precipitation-graph'),
+        dcc.Graph(id='map-graph'),
+        html.Div([
+            dcc.Checklist(
+                id='weather-parameters',
+                options=[
+                    {'label': 'Максимальная температура', 'value': 'temperature_max'},
+                    {'label': 'Минимальная температура', 'value': 'temperature_min'},
+                    {'label': 'Скорость ветра', 'value': 'wind_speed'},
+                    {'label': 'Вероятность осадков', 'value': 'precipitation_probability'}
+                ],
+                value=['temperature_max', 'temperature_min', 'wind_speed', 'precipitation_probability'],
+                labelStyle={'display': 'inline-block', 'margin-right': '10px'}
+            )
+        ], style={'textAlign': 'center', 'marginTop': '20px'})
+    ], className='container')
+
+def get_route_summary():
+    return route_store.get_summary(session.get('route_id'))
+
+def get_route_point(city):
+    return route_store.get_point(session.get('route_id'), city)
+
+# Готовые фигуры для (маршрут, город, параметры), уже в виде словарей для Dash
+FIGURE_CACHE_SIZE = 256
+figure_cache = OrderedDict()
+figure_cache_lock = threading.Lock()
+
+def build_city_figures(selected_city, selected_parameters, summary):
+    city_data = get_route_point(selected_city) or {}
+    city_weather = city_data.get('weather', [])
+    latitude = city_data.get('latitude')
+    longitude = city_data.get('longitude')
+    
+    dates = [day['date'] for day in city_weather]
+    temps_max = [day['temperature_max'] for day in city_weather]
+    temps_min = [day['temperature_min'] for day in city_weather]
+    precipitation = [day['precipitation_probability'] for day in city_weather]
+    
+    # Обе линии строятся всегда, флажки только переключают их видимость
+    temperature_traces = [
+        go.Scatter(
+            x=dates,
+            y=temps_max,
+            mode='lines+markers',
+            name='Максимальная температура',
+            line=dict(color='#FF5733'),
+            hoverinfo='x+y',
+            visible='temperature_max' in selected_parameters
+        ),
+        go.Scatter(
+            x=dates,
+            y=temps_min,
+            mode='lines+markers',
+            name='Минимальная температура',
+            line=dict(color='#33C1FF'),
+            hoverinfo='x+y',
+            visible='temperature_min' in selected_parameters
+        )
+    ]
+    
+    temp_fig = go.Figure(data=temperature_traces)
+    temp_fig.update_layout(
+        title=f'Прогноз температуры для {selected_city}',
+        xaxis_title='Дата',
+        yaxis_title='Температура (°C)',
+        template='plotly_white',
+        hovermode='closest'
+    )
+    
+    precip_trace = go.Bar(
+        x=dates,
+        y=precipitation,
+        name='Вероятность осадков',
+        marker_color='#42f44b',
+        hoverinfo='x+y'
+    )
+    precip_fig = go.Figure(data=[precip_trace])
+    precip_fig.update_layout(
+        title=f'Вероятность осадков для {selected_city}',
+        xaxis_title='Дата',
+        yaxis_title='Вероятность осадков (%)',
+        template='plotly_white',
+        hovermode='closest'
+    )
+    
+    # Создание маршрута на карте
+    points = summary['points']
+    latitudes = [point['latitude'] for point in points]
+    longitudes = [point['longitude'] for point in points]
+    city_names = [point['city'] for point in points]
+    weather_conditions = [point['weather_condition'] for point in points]
+    
+    # Добавление линии маршрута
+    route_trace = go.Scattermapbox(
+        lat=latitudes,
+        lon=longitudes,
+        mode='markers+lines',
+        marker=go.scattermapbox.Marker(
+            size=10,
+            color='#FF5733'
+        ),
+        line=go.scattermapbox.Line(
+            width=2,
+            color='#1f78b4'
+        ),
+        text=[f"{city}: {condition}" for city, condition in zip(city_names, weather_conditions)],
+        hoverinfo='text',
+        name='Маршрут'
+    )
+    
+    map_traces = [route_trace]
+    samples = summary.get('samples')
+    if samples:
+        # Погода в промежуточных точках трассы
+        map_traces.append(go.Scattermapbox(
+            lat=[sample['latitude'] for sample in samples],
+            lon=[sample['longitude'] for sample in samples],
+            mode='markers',
+            marker=go.scattermapbox.Marker(
+                size=7,
+                color=['#CD4A4C' if sample['bad_weather'] else '#138808' for sample in samples]
+            ),
+            text=[f"{sample['name']}: {sample['weather_condition']}" for sample in samples],
+            hoverinfo='text',
+            name='Погода на трассе'
+        ))
+    
+    # Создание фигуры карты
+    map_fig = go.Figure(data=map_traces)
+    map_fig.update_layout(
+        mapbox=dict(
+            style="open-street-map",
+            center=dict(lat=latitude, lon=longitude),
+            zoom=5
+        ),
+        margin={"r":0,"t":0,"l":0,"b":0},
+        hovermode='closest'
+    )
+    
+    return temp_fig.to_dict(), precip_fig.to_dict(), map_fig.to_dict()
+
+def get_city_figures(selected_city, selected_parameters, summary):
+    key = (session.get('route_id'), selected_city, tuple(sorted(selected_parameters or [])))
+    with figure_cache_lock:
+        figures = figure_cache.get(key)
+        if figures is not None:
+            figure_cache.move_to_end(key)
+            return figures
+    figures = build_city_figures(selected_city, selected_parameters or [], summary)
+    with figure_cache_lock:
+        figure_cache[key] = figures
+        while len(figure_cache) > FIGURE_CACHE_SIZE:
+            figure_cache.popitem(last=False)
+    return figures
+
+@timed(DASH_CALLBACK_DURATION, callback="update_graphs")
+def update_graphs(selected_city, selected_parameters):
+    if not selected_city:
+        return go.Figure(), go.Figure(), go.Figure(), []
+    
+    summary = get_route_summary()
+    if not summary:
+        logger.error("Нет данных маршрута для построения графиков")
+        return go.Figure(), go.Figure(), go.Figure(), []
+    
+    options = [{'label': point['city'], 'value': point['city']} for point in summary['points']]
+    
+    if selected_city not in [point['city'] for point in summary['points']]:
+        return go.Figure(), go.Figure(), go.Figure(), options
+    
+    temp_fig, precip_fig, map_fig = get_city_figures(selected_city, selected_parameters, summary)
+    return temp_fig, precip_fig, map_fig, options
+
+@timed(DASH_CALLBACK_DURATION, callback="toggle_temperature_traces")
+def toggle_temperature_traces(selected_parameters):
+    # Частичное обновление: меняется только видимость линий, фигура не пересобирается
+    selected_parameters = selected_parameters or []
+    patch = Patch()
+    patch['data'][0]['visible'] = 'temperature_max' in selected_parameters
+    patch['data'][1]['visible'] = 'temperature_min' in selected_parameters
+    return patch
+
+def create_dash_app(server, store):
+    global route_store
+    route_store = store
+
+    dash_app = dash.Dash(
+        __name__,
+        server=server,
+        url_base_pathname='/dash/',
+        external_stylesheets=['https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css']
+    )
+    dash_app.layout = create_dash_layout
+
+    dash_app.callback(
+        [Output('temperature-graph', 'figure'),
+         Output('precipitation-graph', 'figure'),
+         Output('map-graph', 'figure'),
+         Output('city-dropdown', 'options')],
+        [Input('city-dropdown', 'value')],
+        [State('weather-parameters', 'value')]
+    )(update_graphs)
+    dash_app.callback(
+        Output('temperature-graph', 'figure', allow_duplicate=True),
+        Input('weather-parameters', 'value'),
+        prevent_initial_call=True
+    )(toggle_temperature_traces)
+    return dash_app
@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from metrics import CACHE_LOOKUP_DURATION, CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class ForecastCache:
+    """Кэш прогнозов, общий для всех воркеров gunicorn.
+
+    Два уровня: LRU в памяти процесса (OrderedDict, вытеснение за O(1)) и
+    файл SQLite, который видят все процессы. Одновременные промахи по одному
+    ключу схлопываются в один запрос к AccuWeather (локальная блокировка внутри
+    процесса и lease-запись в SQLite между процессами). В последние stale_ttl
+    секунд жизни записи отдаётся старое значение, а обновление идёт в фоне.
+    Ошибки (результаты, для которых is_error() истинно) не кэшируются.
+    """
+
+    def __init__(self, path, ttl=3600, stale_ttl=300, max_entries=5000,
+                 memory_entries=512, lease_timeout=15, touch_interval=60):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.lease_timeout = lease_timeout
+        self.touch_interval = touch_interval
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()
+        # Когда accessed_at ключа в файле последний раз обновлялся этим процессом
+        self._touched = {}
+        self._revalidating = set()
+        self._key_locks = {}
+        self._key_locks_guard = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS forecasts ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " fresh_until REAL NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS forecasts_accessed ON forecasts (accessed_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                " key TEXT PRIMARY KEY,"
+                " expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key, entry):
+        with self._memory_lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                evicted, _ = self._memory.popitem(last=False)
+                self._touched.pop(evicted, None)
+
+    def _read(self, key, now):
+        row = self._connect().execute(
+            "SELECT value, fresh_until, expires_at FROM forecasts WHERE key = ? AND expires_at > ?",
+            (key, now)
+        ).fetchone()
+        return (json.loads(row[0]), row[1], row[2]) if row else None
+
+    def get(self, key):
+        """Возвращает (value, "fresh" | "stale") или (None, None), если записи нет."""
+        now = time.time()
+        touch = True
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    # Попадания в памяти тоже продлевают жизнь записи в файле, но не чаще touch_interval:
+                    # иначе самые горячие ключи выглядели бы для _trim давно не читавшимися
+                    touch = now - self._touched.get(key, 0) >= self.touch_interval
+                else:
+                    # Другой воркер мог уже обновить запись в общем файле
+                    entry = None
+            if touch:
+                self._touched[key] = now
+        if entry is None:
+            entry = self._read(key, now)
+            if entry is None:
+                return None, None
+            self._remember(key, entry)
+        if touch:
+            self._connect().execute("UPDATE forecasts SET accessed_at = ? WHERE key = ?", (now, key))
+        value, fresh_until, _ = entry
+        return value, "fresh" if fresh_until > now else "stale"
+
+    def expires_in(self, key):
+        """Секунды до истечения записи или None, если записи нет.
+
+        Читается общий файл, а не память процесса: запись мог уже обновить другой воркер.
+        """
+        now = time.time()
+        row = self._connect().execute(
+            "SELECT expires_at FROM forecasts WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row[0] - now if row else None
+
+    def set(self, key, value):
+        now = time.time()
+        fresh_until = now + self.ttl - self.stale_ttl
+        expires_at = now + self.ttl
+        self._remember(key, (value, fresh_until, expires_at))
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO forecasts (key, value, fresh_until, expires_at, accessed_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), fresh_until, expires_at, now)
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._trim(conn)
+
+    def _trim(self, conn):
+        # Вытеснение идёт по индексу accessed_at, без сортировки всей таблицы
+        conn.execute("DELETE FROM forecasts WHERE expires_at <= ?", (time.time(),))
+        count = conn.execute("SELECT COUNT(*) FROM forecasts").fetchone()[0]
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM forecasts WHERE key IN"
+                " (SELECT key FROM forecasts ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    @contextmanager
+    def _key_lock(self, key, blocking=True):
+        """Блокировка ключа внутри процесса; отдаёт False, если blocking=False и она занята.
+
+        Запись о блокировке удаляется, как только ключ никто не держит и не ждёт.
+        """
+        with self._key_locks_guard:
+            entry = self._key_locks.get(key)
+            if entry is None:
+                entry = self._key_locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        acquired = entry[0].acquire(blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                entry[0].release()
+            with self._key_locks_guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[key]
+
+    def _acquire_lease(self, key):
+        now = time.time()
+        conn = self._connect()
+        conn.execute("DELETE FROM leases WHERE key = ? AND expires_at <= ?", (key, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO leases (key, expires_at) VALUES (?, ?)",
+            (key, now + self.lease_timeout)
+        )
+        return cursor.rowcount == 1
+
+    def _release_lease(self, key):
+        self._connect().execute("DELETE FROM leases WHERE key = ?", (key,))
+
+    def _load(self, key, loader, is_error):
+        value = loader()
+        if not is_error(value):
+            self.set(key, value)
+        return value
+
+    def _revalidate(self, key, loader, is_error, min_ttl):
+        try:
+            with self._key_lock(key, blocking=False) as acquired:
+                if not acquired or not self._acquire_lease(key):
+                    return
+                try:
+                    # Пока ждали lease, запись мог обновить другой воркер - тогда запрос не нужен
+                    entry = self._read(key, time.time())
+                    if entry is not None and entry[2] - time.time() > min_ttl:
+                        self._remember(key, entry)
+                        return
+                    self._load(key, loader, is_error)
+                finally:
+                    self._release_lease(key)
+        except Exception as e:
+            logger.error("Ошибка фонового обновления прогноза %s: %s", key, e)
+
+    def _revalidate_in_background(self, key, loader, is_error):
+        # Поток запускается, только если этот ключ ещё не обновляется в этом процессе
+        with self._memory_lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def run():
+            try:
+                self._revalidate(key, loader, is_error, self.stale_ttl)
+            finally:
+                with self._memory_lock:
+                    self._revalidating.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def refresh(self, key, loader, is_error=lambda value: False, min_ttl=None):
+        """Синхронно обновляет запись, если её уже не обновляет другой поток или процесс.
+
+        Запрос не выполняется, если в общем файле запись проживёт ещё больше
+        min_ttl секунд (по умолчанию stale_ttl), то есть её уже обновили.
+        """
+        self._revalidate(key, loader, is_error, self.stale_ttl if min_ttl is None else min_ttl)
+
+    def get_or_load(self, key, loader, is_error=lambda value: False):
+        with CACHE_LOOKUP_DURATION.time(cache="forecast"):
+            value, state = self.get(key)
+        CACHE_REQUESTS.inc(cache="forecast", result={"fresh": "hit", "stale": "stale"}.get(state, "miss"))
+        if state == "fresh":
+            return value
+        if state == "stale":
+            self._revalidate_in_background(key, loader, is_error)
+            return value
+
+        with self._key_lock(key):
+            value, state = self.get(key)
+            if state is not None:
+                return value
+            deadline = time.time() + self.lease_timeout
+            while not self._acquire_lease(key):
+                # Прогноз уже загружает другой процесс - ждём его результат
+                if time.time() >= deadline:
+                    return self._load(key, loader, is_error)
+                time.sleep(0.05)
+                value, state = self.get(key)
+                if state is not None:
+                    return value
+            try:
+                return self._load(key, loader, is_error)
+            finally:
+                self._release_lease(key)
+
+
+def create_forecast_cache():
+    return ForecastCache(
+        os.getenv("FORECAST_CACHE_PATH", "forecast_cache.sqlite3"),
+        ttl=int(os.getenv("FORECAST_CACHE_TTL", "3600")),
+        stale_ttl=int(os.getenv("FORECAST_CACHE_STALE_TTL", "300")),
+        max_entries=int(os.getenv("FORECAST_CACHE_MAX_ENTRIES", "5000"))
+    )
@@ -0,0 +1,152 @@
+import math
+import os
+from array import array
+
+# Битовая маска погодных условий дня
+BAD_TEMPERATURE = 1
+STRONG_WIND = 2
+HIGH_PRECIPITATION = 4
+
+CONDITION_LABELS = (
+    (BAD_TEMPERATURE, "Температура слишком низкая или высокая"),
+    (STRONG_WIND, "Сильный ветер"),
+    (HIGH_PRECIPITATION, "Высокая вероятность осадков"),
+)
+
+DEFAULT_THRESHOLDS = {
+    "temperature_min": -15,
+    "temperature_max": 35,
+    "wind_speed": 50,
+    "precipitation_probability": 60,
+}
+
+NAN = float("nan")
+
+NUMERIC_COLUMNS = ("temperature_max", "temperature_min", "wind_speed", "precipitation_probability")
+
+
+def load_thresholds():
+    return {
+        "temperature_min": float(os.getenv("BAD_WEATHER_TEMPERATURE_MIN", DEFAULT_THRESHOLDS["temperature_min"])),
+        "temperature_max": float(os.getenv("BAD_WEATHER_TEMPERATURE_MAX", DEFAULT_THRESHOLDS["temperature_max"])),
+        "wind_speed": float(os.getenv("BAD_WEATHER_WIND_SPEED", DEFAULT_THRESHOLDS["wind_speed"])),
+        "precipitation_probability": float(
+            os.getenv("BAD_WEATHER_PRECIPITATION", DEFAULT_THRESHOLDS["precipitation_probability"])
+        ),
+    }
+
+
+def classify_weather(temperatures, wind_speeds, precipitation, thresholds=DEFAULT_THRESHOLDS):
+    """Маски условий для целых столбцов значений; пропуски (NaN) не считаются плохой погодой."""
+    low = thresholds["temperature_min"]
+    high = thresholds["temperature_max"]
+    wind = thresholds["wind_speed"]
+    precip = thresholds["precipitation_probability"]
+    return array("B", (
+        (BAD_TEMPERATURE if t < low or t > high else 0)
+        | (STRONG_WIND if w > wind else 0)
+        | (HIGH_PRECIPITATION if p > precip else 0)
+        for t, w, p in zip(temperatures, wind_speeds, precipitation)
+    ))
+
+
+def classify_columns(columns_list, thresholds=DEFAULT_THRESHOLDS):
+    """Классифицирует сразу пачку прогнозов (несколько городов) одним проходом."""
+    temperatures = array("d")
+    wind_speeds = array("d")
+    precipitation = array("d")
+    for columns in columns_list:
+        temperatures.extend(columns.temperature_max)
+        wind_speeds.extend(columns.wind_speed)
+        precipitation.extend(columns.precipitation_probability)
+    masks = classify_weather(temperatures, wind_speeds, precipitation, thresholds)
+    offset = 0
+    for columns in columns_list:
+        columns.conditions = masks[offset:offset + len(columns)]
+        offset += len(columns)
+    return columns_list
+
+
+def condition_text(mask):
+    """Текст для показа пользователю; решения принимаются по маске (bad_weather), а не по этой строке."""
+    conditions = [label for flag, label in CONDITION_LABELS if mask & flag]
+    if conditions:
+        return "Плохие погодные условия: " + ", ".join(conditions)
+    return "Хорошие погодные условия"
+
+
+def _number(value):
+    return float(value) if isinstance(value, (int, float)) else NAN
+
+
+def _display(value):
+    if math.isnan(value):
+        return "N/A"
+    return int(value) if value.is_integer() else value
+
+
+class ForecastColumns:
+    """Подневный прогноз одного города в виде столбцов (array), а не списка словарей.
+
+    В кэше прогноз хранится как to_dict() - только исходные столбцы, без
+    классификации, так что смена порогов BAD_WEATHER_* не требует сброса кэша.
+    Подневные словари строит to_days() уже для отрисовки и API.
+    """
+
+    __slots__ = ("dates", "temperature_max", "temperature_min", "wind_speed",
+                 "precipitation_probability", "conditions")
+
+    def __init__(self):
+        self.dates = []
+        self.temperature_max = array("d")
+        self.temperature_min = array("d")
+        self.wind_speed = array("d")
+        self.precipitation_probability = array("d")
+        self.conditions = array("B")
+
+    def __len__(self):
+        return len(self.dates)
+
+    @classmethod
+    def from_accuweather(cls, data):
+        """Разбирает ответ forecasts/v1/daily за один проход, каждый путь в JSON читается один раз."""
+        columns = cls()
+        for forecast in data.get("DailyForecasts", []):
+            temperature = forecast.get("Temperature", {})
+            day = forecast.get("Day", {})
+            columns.dates.append(forecast.get("Date", "N/A")[:10])
+            columns.temperature_max.append(_number(temperature.get("Maximum", {}).get("Value")))
+            columns.temperature_min.append(_number(temperature.get("Minimum", {}).get("Value")))
+            columns.wind_speed.append(_number(day.get("Wind", {}).get("Speed", {}).get("Value")))
+            columns.precipitation_probability.append(_number(day.get("PrecipitationProbability")))
+        return columns
+
+    def to_dict(self):
+        """Компактное JSON-представление для кэша; пропуски (NaN) записываются как None."""
+        data = {"dates": list(self.dates)}
+        for name in NUMERIC_COLUMNS:
+            data[name] = [None if math.isnan(value) else value for value in getattr(self, name)]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        columns = cls()
+        columns.dates = list(data.get("dates", []))
+        for name in NUMERIC_COLUMNS:
+            setattr(columns, name, array("d", map(_number, data.get(name, []))))
+        return columns
+
+    def to_days(self):
+        """Прежнее представление: список словарей по дням, как его ждут шаблон, Dash и API."""
+        return [{
+            "date": date,
+            "temperature_max": _display(temperature_max),
+            "temperature_min": _display(temperature_min),
+            "wind_speed": _display(wind_speed),
+            "precipitation_probability": _display(precipitation),
+            "weather_condition": condition_text(mask),
+            "bad_weather": mask != 0,
+        } for date, temperature_max, temperature_min, wind_speed, precipitation, mask in zip(
+            self.dates, self.temperature_max, self.temperature_min, self.wind_speed,
+            self.precipitation_probability, self.conditions
+        )]
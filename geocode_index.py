@@ -0,0 +1,163 @@
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+# Транслитерация кириллицы в латиницу, чтобы "Москва" и "moskva" вели к одной записи
+TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e",
+    "ж": "zh", "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch",
+    "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+}
+
+
+def normalize_city(query):
+    query = unicodedata.normalize("NFKC", query or "").casefold()
+    query = query.replace("ё", "е").replace("-", " ")
+    return " ".join(query.split())
+
+
+def transliterate(query):
+    return "".join(TRANSLIT.get(char, char) for char in query)
+
+
+def query_variants(query):
+    normalized = normalize_city(query)
+    variants = [normalized]
+    latin = transliterate(normalized)
+    if latin != normalized:
+        variants.append(latin)
+    return variants
+
+
+class GeocodeIndex:
+    """Локальный индекс геокодирования в SQLite, переживающий перезапуск.
+
+    Хранит найденные города (Key/LocalizedName/Latitude/Longitude) и
+    отрицательные результаты "город не найден" с более коротким TTL.
+    Официальные названия городов хранятся отдельно (aliases) и используются
+    только для подсказок: lookup отвечает лишь на запросы, которые уже
+    отправлялись в AccuWeather, и не подменяет его ранжирование.
+    """
+
+    def __init__(self, path, ttl=30 * 24 * 3600, negative_ttl=6 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS locations ("
+                " query TEXT PRIMARY KEY,"
+                " key TEXT,"
+                " name TEXT,"
+                " latitude REAL,"
+                " longitude REAL,"
+                " expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS aliases ("
+                " query TEXT PRIMARY KEY,"
+                " name TEXT NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, query):
+        """Возвращает (True, location_or_None) при попадании и (False, None) при промахе."""
+        variants = query_variants(query)
+        placeholders = ",".join("?" * len(variants))
+        # Отрицательный результат действует только для того же запроса, а
+        # точное совпадение важнее транслитерации
+        row = self._connect().execute(
+            f"SELECT key, name, latitude, longitude FROM locations"
+            f" WHERE query IN ({placeholders}) AND expires_at > ? AND (query = ? OR key IS NOT NULL)"
+            f" ORDER BY query = ? DESC LIMIT 1",
+            (*variants, time.time(), variants[0], variants[0])
+        ).fetchone()
+        if row is None:
+            return False, None
+        if row[0] is None:
+            return True, None
+        return True, {
+            "Key": row[0],
+            "LocalizedName": row[1],
+            "Latitude": row[2],
+            "Longitude": row[3]
+        }
+
+    def store(self, query, location, aliases=True):
+        now = time.time()
+        self._writes += 1
+        with self._connect() as conn:
+            if self._writes % 100 == 0:
+                self._trim(conn, now)
+            if location is None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO locations"
+                    " (query, key, name, latitude, longitude, expires_at)"
+                    " VALUES (?, NULL, NULL, NULL, NULL, ?)",
+                    (normalize_city(query), now + self.negative_ttl)
+                )
+                return
+            conn.executemany(
+                "INSERT OR REPLACE INTO locations"
+                " (query, key, name, latitude, longitude, expires_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(variant, location.get("Key"), location.get("LocalizedName"),
+                  location.get("Latitude"), location.get("Longitude"), now + self.ttl)
+                 for variant in query_variants(query)]
+            )
+            if aliases and location.get("LocalizedName"):
+                # Официальное название - только для автодополнения
+                conn.executemany(
+                    "INSERT OR REPLACE INTO aliases (query, name, expires_at) VALUES (?, ?, ?)",
+                    [(variant, location["LocalizedName"], now + self.ttl)
+                     for variant in query_variants(location["LocalizedName"])]
+                )
+
+    def _trim(self, conn, now):
+        # Истёкшие записи при чтении отфильтровываются, но без удаления файл рос бы бесконечно
+        conn.execute("DELETE FROM locations WHERE expires_at <= ?", (now,))
+        conn.execute("DELETE FROM aliases WHERE expires_at <= ?", (now,))
+
+    def search_prefix(self, prefix, limit=10):
+        """Подсказки для автодополнения без обращения к AccuWeather."""
+        names = []
+        for variant in query_variants(prefix):
+            if not variant:
+                continue
+            bounds = (variant, variant + "\U0010ffff", time.time())
+            rows = self._connect().execute(
+                "SELECT query, name FROM locations"
+                " WHERE query >= ? AND query < ? AND key IS NOT NULL AND expires_at > ?"
+                " UNION SELECT query, name FROM aliases"
+                " WHERE query >= ? AND query < ? AND expires_at > ?"
+                " ORDER BY query LIMIT ?",
+                (*bounds, *bounds, limit * 4)
+            ).fetchall()
+            for _, name in rows:
+                if name not in names:
+                    names.append(name)
+        return names[:limit]
+
+
+def create_geocode_index():
+    path = os.getenv("GEOCODE_INDEX_PATH", "geocode_index.sqlite3")
+    return GeocodeIndex(
+        path,
+        ttl=int(os.getenv("GEOCODE_TTL", 30 * 24 * 3600)),
+        negative_ttl=int(os.getenv("GEOCODE_NEGATIVE_TTL", 6 * 3600))
+    )
@@ -0,0 +1,190 @@
+"""Метрики в текстовом формате Prometheus и трассировка запросов.
+
+Метрики собираются в памяти процесса и отдаются эндпоинтом /metrics.
+Трассировка включается переменной TRACE_REQUESTS=1: каждый замеренный
+участок (span) пишется в лог с идентификатором запроса.
+"""
+import contextvars
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+trace_logger = logging.getLogger("trace")
+
+# Идентификатор текущего запроса для трассировки; "-" вне запроса
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+            state[1] += 1
+            state[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, (bucket_counts, count, total) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    labels = _format_labels(self.labelnames, values, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _format_labels(self.labelnames, values, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, values)
+                lines.append(f"{self.name}_count{labels} {count}")
+                lines.append(f"{self.name}_sum{labels} {total}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+FUNCTION_DURATION = Histogram(
+    "weather_function_duration_seconds", "Время выполнения функций горячего пути", ["function"]
+)
+CACHE_LOOKUP_DURATION = Histogram(
+    "weather_cache_lookup_duration_seconds", "Время поиска в кэше", ["cache"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+)
+CACHE_REQUESTS = Counter(
+    "weather_cache_requests_total", "Обращения к кэшам по результату (hit/miss/stale)", ["cache", "result"]
+)
+UPSTREAM_DURATION = Histogram(
+    "accuweather_request_duration_seconds", "Время одного HTTP-запроса к AccuWeather", ["endpoint"]
+)
+UPSTREAM_RESPONSES = Counter(
+    "accuweather_responses_total", "Ответы AccuWeather по коду статуса", ["endpoint", "status"]
+)
+UPSTREAM_RETRIES = Counter(
+    "accuweather_retries_total", "Повторные запросы к AccuWeather", ["endpoint"]
+)
+UPSTREAM_QUOTA_REMAINING = Gauge(
+    "accuweather_quota_remaining", "Остаток квоты по заголовку RateLimit-Remaining"
+)
+TEMPLATE_RENDER_DURATION = Histogram(
+    "weather_template_render_duration_seconds", "Время отрисовки шаблонов", ["template"]
+)
+DASH_CALLBACK_DURATION = Histogram(
+    "weather_dash_callback_duration_seconds", "Время выполнения колбэков Dash", ["callback"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "weather_http_request_duration_seconds", "Время обработки HTTP-запросов", ["endpoint", "method", "status"]
+)
+SESSION_COOKIE_BYTES = Histogram(
+    "weather_request_cookie_bytes", "Размер заголовка Cookie входящих запросов",
+    buckets=(64, 256, 1024, 2048, 4096, 8192)
+)
+
+trace_enabled = False
+
+
+def trace(span, seconds, **fields):
+    if trace_enabled:
+        details = "".join(f" {name}={value}" for name, value in fields.items())
+        trace_logger.info("request_id=%s span=%s duration_ms=%.1f%s",
+                          request_id_var.get(), span, seconds * 1000, details)
+
+
+def timed(histogram, span=None, **labels):
+    """Декоратор: замер в histogram и, при включённой трассировке, запись span в лог."""
+    def decorator(func):
+        name = span or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - started
+                histogram.observe(seconds, **labels)
+                trace(name, seconds)
+        return wrapper
+    return decorator
@@ -0,0 +1,89 @@
+import math
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS_KM = 6371.0
+
+
+def geohash_encode(latitude, longitude, precision=4):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        value_range, value = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            value_range[0] = middle
+        else:
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def geohash_center(geohash):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        index = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            value_range = lon_range if even else lat_range
+            middle = (value_range[0] + value_range[1]) / 2
+            if index >> shift & 1:
+                value_range[0] = middle
+            else:
+                value_range[1] = middle
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def distance_km(start, end):
+    lat1, lon1, lat2, lon2 = map(math.radians, (*start, *end))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def interpolate_route(points, spacing_km):
+    """Точки между соседними парами (lat, lon) примерно через spacing_km, сами концы не входят."""
+    samples = []
+    for start, end in zip(points, points[1:]):
+        count = int(distance_km(start, end) // spacing_km)
+        for step in range(1, count + 1):
+            fraction = step / (count + 1)
+            samples.append((
+                start[0] + (end[0] - start[0]) * fraction,
+                start[1] + (end[1] - start[1]) * fraction
+            ))
+    return samples
+
+
+def densify_route(points, spacing_km=50, precision=4, max_samples=30):
+    """Ячейки геохеша вдоль маршрута в порядке следования, без повторов.
+
+    Возвращает список (geohash, lat, lon), где lat/lon - центр ячейки: все
+    маршруты, проходящие через ячейку, запрашивают погоду в одной и той же точке.
+    """
+    endpoints = {geohash_encode(lat, lon, precision) for lat, lon in points}
+    cells = []
+    seen = set(endpoints)
+    for latitude, longitude in interpolate_route(points, spacing_km):
+        cell = geohash_encode(latitude, longitude, precision)
+        if cell in seen:
+            continue
+        seen.add(cell)
+        cells.append((cell, *geohash_center(cell)))
+    if len(cells) > max_samples:
+        # Лимит распределяется равномерно по всему маршруту, а не только по его началу
+        step = len(cells) / max_samples
+        cells = [cells[int(index * step)] for index in range(max_samples)]
+    return cells
@@ -0,0 +1,170 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class RouteStore:
+    """Серверное хранилище маршрутов: в cookie сессии остаётся только route_id.
+
+    Каждая точка маршрута хранится отдельно в виде компактного JSON, а краткие
+    сведения о маршруте (города, координаты, состояние погоды) - отдельно, так
+    что для списка городов или ответа /api/weather не нужно разбирать весь
+    прогноз. Маршруты лежат в файле SQLite, общем для всех воркеров gunicorn:
+    запрос к /api/weather или /dash/ может попасть не в тот процесс, который
+    обработал форму. Записи живут ttl секунд, при превышении max_bytes
+    вытесняются давно не читавшиеся. Перед файлом - LRU в памяти процесса
+    объёмом до memory_bytes.
+    """
+
+    def __init__(self, path, ttl=3600, max_bytes=64 * 1024 * 1024, memory_bytes=8 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self._routes = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS routes ("
+                " route_id TEXT PRIMARY KEY,"
+                " summary TEXT NOT NULL,"
+                " points BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS routes_accessed ON routes (accessed_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def new_route_id(self):
+        return secrets.token_urlsafe(12)
+
+    def save(self, points, days, route_id=None, samples=()):
+        route_id = route_id or self.new_route_id()
+        summary = {
+            "days": days,
+            "samples": list(samples),
+            "points": [{
+                "city": point["city"],
+                "latitude": point["latitude"],
+                "longitude": point["longitude"],
+                "weather_condition": point["weather"][-1]["weather_condition"] if point["weather"] else ""
+            } for point in points]
+        }
+        blobs = [json.dumps(point, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                 for point in points]
+        summary_json = json.dumps(summary, ensure_ascii=False)
+        size = sum(len(blob) for blob in blobs) + len(summary_json)
+        now = time.time()
+        self._remember(route_id, (summary, blobs, size, now + self.ttl))
+        conn = self._connect()
+        # В компактном JSON нет переводов строк, поэтому точки хранятся через "\n"
+        conn.execute(
+            "INSERT OR REPLACE INTO routes (route_id, summary, points, size, expires_at, accessed_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (route_id, summary_json, b"\n".join(blobs), size, now + self.ttl, now)
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._trim(conn)
+        return route_id
+
+    def _trim(self, conn):
+        conn.execute("DELETE FROM routes WHERE expires_at <= ?", (time.time(),))
+        # Удаляются самые давние по обращению маршруты, не помещающиеся в max_bytes
+        conn.execute(
+            "DELETE FROM routes WHERE route_id IN ("
+            " SELECT route_id FROM ("
+            "  SELECT route_id, SUM(size) OVER (ORDER BY accessed_at DESC) AS total FROM routes"
+            " ) WHERE total > ?)",
+            (self.max_bytes,)
+        )
+
+    def _remember(self, route_id, entry):
+        with self._lock:
+            previous = self._routes.pop(route_id, None)
+            if previous is not None:
+                self._size -= previous[2]
+            self._routes[route_id] = entry
+            self._size += entry[2]
+            self._evict()
+
+    def _evict(self):
+        now = time.time()
+        while self._routes:
+            route_id, entry = next(iter(self._routes.items()))
+            if self._size <= self.memory_bytes and entry[3] > now:
+                break
+            del self._routes[route_id]
+            self._size -= entry[2]
+
+    def _entry(self, route_id):
+        if not route_id:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._routes.get(route_id)
+            if entry is not None:
+                if entry[3] > now:
+                    self._routes.move_to_end(route_id)
+                    return entry
+                del self._routes[route_id]
+                self._size -= entry[2]
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT summary, points, size, expires_at FROM routes WHERE route_id = ? AND expires_at > ?",
+            (route_id, now)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE routes SET accessed_at = ? WHERE route_id = ?", (now, route_id))
+        entry = (json.loads(row[0]), bytes(row[1]).split(b"\n") if row[1] else [], row[2], row[3])
+        self._remember(route_id, entry)
+        return entry
+
+    def get_summary(self, route_id):
+        """Дни прогноза и список точек без подневных данных."""
+        entry = self._entry(route_id)
+        return entry[0] if entry else None
+
+    def get_point(self, route_id, city):
+        entry = self._entry(route_id)
+        if entry is None:
+            return None
+        for summary_point, blob in zip(entry[0]["points"], entry[1]):
+            if summary_point["city"] == city:
+                return json.loads(blob)
+        return None
+
+    def get_points(self, route_id):
+        entry = self._entry(route_id)
+        return [json.loads(blob) for blob in entry[1]] if entry else None
+
+    def get_points_json(self, route_id):
+        """JSON-массив точек маршрута, собранный из сохранённых фрагментов без разбора."""
+        entry = self._entry(route_id)
+        return b"[" + b",".join(entry[1]) + b"]" if entry else None
+
+
+def create_route_store():
+    return RouteStore(
+        os.getenv("ROUTE_STORE_PATH", "route_store.sqlite3"),
+        ttl=int(os.getenv("ROUTE_STORE_TTL", "3600")),
+        max_bytes=int(os.getenv("ROUTE_STORE_MAX_BYTES", 64 * 1024 * 1024)),
+        memory_bytes=int(os.getenv("ROUTE_STORE_MEMORY_BYTES", 8 * 1024 * 1024))
+    )
@@ -0,0 +1,57 @@
+import os
+import tempfile
+
+# app читает настройки при импорте: ключ и файлы кэшей - во временном каталоге
+_workdir = tempfile.mkdtemp(prefix="weather-test-")
+os.environ.setdefault("ACCUWEATHER_API_KEY", "test")
+os.environ.update({
+    "GEOCODE_INDEX_PATH": os.path.join(_workdir, "geocode_index.sqlite3"),
+    "FORECAST_CACHE_PATH": os.path.join(_workdir, "forecast_cache.sqlite3"),
+    "ROUTE_STORE_PATH": os.path.join(_workdir, "route_store.sqlite3"),
+    "PREFETCH_ENABLED": "0",
+    "DASH_MODE": "off"
+})
+
+import threading  # noqa: E402
+
+import app  # noqa: E402
+
+FORECAST = {
+    "dates": ["2024-01-01"],
+    "temperature_max": [5],
+    "temperature_min": [0],
+    "wind_speed": [10],
+    "precipitation_probability": [20]
+}
+
+
+def test_batch_finishes_routes_whose_city_maps_to_loaded_forecast(monkeypatch):
+    # "Moskva" геокодируется только после того, как прогноз для "Moscow" (тот же Key) уже получен
+    forecast_loaded = threading.Event()
+
+    def get_location(city):
+        if city == "Moskva":
+            forecast_loaded.wait(5)
+        return {"Key": "294021", "LocalizedName": "Moscow", "Latitude": 55.75, "Longitude": 37.62}
+
+    def get_weather(location_key, days=5):
+        forecast_loaded.set()
+        return FORECAST
+
+    monkeypatch.setattr(app, "get_location_key_by_city", get_location)
+    monkeypatch.setattr(app, "get_weather", get_weather)
+
+    results = dict(app.resolve_routes_batch([(["Moscow"], 5), (["Moskva"], 5)]))
+
+    assert sorted(results) == [0, 1]
+    assert results[1]["weather"][0]["city"] == "Moscow"
+
+
+def test_routes_api_limits_cities_per_route(monkeypatch):
+    monkeypatch.setattr(app, "MAX_ROUTE_CITIES", 3)
+    client = app.app.test_client()
+
+    response = client.post("/api/routes", json={"routes": [["A", "B", "C", "D"]]})
+
+    assert response.status_code == 400
+    assert "limit is 3" in response.get_json()["error"]
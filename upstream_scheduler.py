@@ -0,0 +1,165 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class QuotaExceededError(requests.exceptions.RequestException):
+    """Лимит запросов к AccuWeather исчерпан, запрос не отправлялся."""
+
+
+class QuotaScheduler:
+    """Token bucket, рассчитанный на суточную квоту ключа AccuWeather.
+
+    Состояние корзины хранится в строке SQLite (файл path, обычно рядом с
+    кэшем прогнозов) и меняется в транзакции, поэтому квоту расходуют все
+    воркеры gunicorn вместе, а не каждый по отдельности. Интерактивные запросы
+    могут подождать токен до max_wait секунд и имеют приоритет: фоновые
+    запросы получают токен, только если никто из пользователей этого процесса
+    его не ждёт и в корзине остаётся резерв background_reserve.
+    """
+
+    def __init__(self, daily_quota, path, burst=None, background_reserve=0.25, max_wait=2.0,
+                 poll_interval=0.05):
+        self.rate = daily_quota / 86400
+        self.capacity = burst or max(1, daily_quota // 24)
+        self.reserve = self.capacity * background_reserve
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.path = path
+        self._local = threading.local()
+        self._waiting_interactive = 0
+        self._waiting_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS quota ("
+                " name TEXT PRIMARY KEY,"
+                " tokens REAL NOT NULL,"
+                " updated REAL NOT NULL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO quota (name, tokens, updated) VALUES ('accuweather', ?, ?)",
+                (float(self.capacity), time.time())
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _take(self, minimum):
+        """Списывает токен, если после пополнения в корзине не меньше minimum; возвращает (успех, токены)."""
+        conn = self._connect()
+        # BEGIN IMMEDIATE сразу берёт блокировку записи: два процесса не потратят один токен
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            tokens, updated = conn.execute(
+                "SELECT tokens, updated FROM quota WHERE name = 'accuweather'"
+            ).fetchone()
+            tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+            taken = tokens >= minimum
+            if taken:
+                tokens -= 1
+            conn.execute(
+                "UPDATE quota SET tokens = ?, updated = ? WHERE name = 'accuweather'", (tokens, now)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return taken, tokens
+
+    def acquire(self, priority=INTERACTIVE):
+        if priority == BACKGROUND:
+            if self._waiting_interactive or not self._take(1 + self.reserve)[0]:
+                raise QuotaExceededError("Фоновый запрос отложен: бережём квоту AccuWeather")
+            return
+
+        deadline = time.monotonic() + self.max_wait
+        with self._waiting_lock:
+            self._waiting_interactive += 1
+        try:
+            while True:
+                taken, tokens = self._take(1)
+                if taken:
+                    return
+                # Токены могут только прибывать со скоростью rate, так что ждать дольше max_wait бессмысленно
+                wait = (1 - tokens) / self.rate
+                remaining = deadline - time.monotonic()
+                if wait > remaining:
+                    raise QuotaExceededError("Исчерпан лимит запросов к AccuWeather, повторите попытку позже")
+                time.sleep(max(wait, self.poll_interval))
+        finally:
+            with self._waiting_lock:
+                self._waiting_interactive -= 1
+
+    def remaining(self):
+        tokens, updated = self._connect().execute(
+            "SELECT tokens, updated FROM quota WHERE name = 'accuweather'"
+        ).fetchone()
+        return int(min(self.capacity, tokens + max(0.0, time.time() - updated) * self.rate))
+
+
+class HotLocationPrefetcher:
+    """Следит за самыми запрашиваемыми прогнозами и обновляет их до истечения кэша.
+
+    expires_in(location_key, days) возвращает число секунд до истечения записи
+    в кэше (или None), refresh(location_key, days) перезапрашивает прогноз.
+    Счётчики популярности делятся пополам каждые decay_interval секунд.
+    Прогнозы отслеживает каждый воркер, а сами обновления согласуются через
+    общий кэш: refresh не обращается к AccuWeather, если запись уже обновил
+    другой процесс.
+    """
+
+    def __init__(self, expires_in, refresh, top_n=20, lead_time=600, interval=60, decay_interval=3600):
+        self.expires_in = expires_in
+        self.refresh = refresh
+        self.top_n = top_n
+        self.lead_time = lead_time
+        self.interval = interval
+        self.decay_interval = decay_interval
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_decay = time.monotonic()
+
+    def record(self, location_key, days):
+        with self._lock:
+            self._counts[(location_key, days)] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="forecast-prefetch", daemon=True)
+                self._thread.start()
+
+    def hot_locations(self):
+        with self._lock:
+            if time.monotonic() - self._last_decay >= self.decay_interval:
+                self._counts = Counter({key: count // 2 for key, count in self._counts.items() if count > 1})
+                self._last_decay = time.monotonic()
+            return [key for key, _ in self._counts.most_common(self.top_n)]
+
+    def run_once(self):
+        for location_key, days in self.hot_locations():
+            expires_in = self.expires_in(location_key, days)
+            if expires_in is None or expires_in < self.lead_time:
+                self.refresh(location_key, days)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("Ошибка фонового обновления прогнозов: %s", e)